@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from xml_pipeline import CircuitBreaker, ListenerNotFoundError, MessageBus
+
+
+def test_route_by_root_and_version():
+    """Messages reach only listeners registered for their root and version."""
+    calls = []
+
+    async def scenario():
+        bus = MessageBus()
+
+        @bus.listener("cad-task")
+        async def any_version(xml):
+            calls.append("any")
+
+        @bus.listener("cad-task", version="2")
+        async def v2_only(xml):
+            calls.append("v2")
+
+        @bus.listener("log-entry")
+        async def logger(xml):
+            calls.append("log")
+
+        await bus.publish(b'<cad-task version="1"/>', cardinality="all")
+        await bus.publish(b'<cad-task version="2"/>', cardinality="all")
+        await bus.close()
+
+    asyncio.run(scenario())
+    assert sorted(calls) == ["any", "any", "v2"]
+
+
+def test_request_all_collects_every_reply():
+    """cardinality="all" waits for each listener, then forgets the request."""
+    async def scenario():
+        bus = MessageBus()
+
+        @bus.listener("cad-task")
+        async def first(xml):
+            return b"<ack>first</ack>"
+
+        @bus.listener("cad-task")
+        async def second(xml):
+            await asyncio.sleep(0.01)
+            return b"<ack>second</ack>"
+
+        replies = await bus.request(b"<cad-task/>", cardinality="all", timeout=2)
+        pending = dict(bus._pending)
+        await bus.close()
+        return replies, pending
+
+    replies, pending = asyncio.run(scenario())
+    assert len(replies) == 2
+    assert any(b"first" in r for r in replies) and any(b"second" in r for r in replies)
+    assert pending == {}
+
+
+def test_request_any_ignores_late_replies():
+    """Replies after the first one find the request already settled and are dropped."""
+    async def scenario():
+        bus = MessageBus()
+
+        @bus.listener("cad-task")
+        async def fast(xml):
+            return b"<ack>fast</ack>"
+
+        @bus.listener("cad-task")
+        async def slow(xml):
+            await asyncio.sleep(0.01)
+            return b"<ack>slow</ack>"
+
+        reply = await bus.request(b"<cad-task/>", cardinality="any", timeout=2)
+        await asyncio.sleep(0.05)  # let the slow reply arrive
+        pending = dict(bus._pending)
+        await bus.close()
+        return reply, pending
+
+    reply, pending = asyncio.run(scenario())
+    assert b"fast" in reply
+    assert pending == {}
+
+
+def test_request_without_listener_is_nacked():
+    """A request nobody listens for fails fast and leaves nothing pending."""
+    async def scenario():
+        bus = MessageBus()
+        try:
+            with pytest.raises(ListenerNotFoundError):
+                await bus.request(b"<nobody/>", timeout=2)
+            return dict(bus._pending)
+        finally:
+            await bus.close()
+
+    assert asyncio.run(scenario()) == {}
+
+
+def test_circuit_recovers_after_timeout():
+    """An open circuit moves to half-open once the recovery timeout passes."""
+    circuit = CircuitBreaker(failure_threshold=2, recovery_timeout=0.0)
+    circuit.record_failure()
+    assert circuit.state == "CLOSED"
+
+    circuit.record_failure()
+    assert not circuit.is_open()
+    assert circuit.state == "HALF_OPEN"
+
+    circuit.recovery_timeout = 60.0
+    circuit.record_failure()
+    assert circuit.is_open()
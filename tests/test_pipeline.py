@@ -1,14 +1,14 @@
 import pytest
 import asyncio
-from xml_pipeline import Pipeline
+from xml_pipeline import Pipeline, UnrepairableMessageError
 from lxml import etree
 
-def test_repair_malformed():
+def test_repair_malformed(make_pipeline):
     """Test that Pipeline can repair malformed XML."""
     broken = b"<cad-task>broken</cad"
     
     # Pipeline.process() is async, so we need to run it with asyncio
-    pipeline = Pipeline()
+    pipeline = make_pipeline()
     repaired, root_tag, version = asyncio.run(pipeline.process(broken))
     
     # Check that the output is well-formed and complete
@@ -20,11 +20,11 @@ def test_repair_malformed():
     assert tree is not None
 
 
-def test_pipeline_basic():
+def test_pipeline_basic(make_pipeline):
     """Test basic pipeline functionality with valid XML."""
     valid_xml = b'<cad-task version="1.0">test content</cad-task>'
     
-    pipeline = Pipeline()
+    pipeline = make_pipeline()
     canonical, root_tag, version = asyncio.run(pipeline.process(valid_xml))
     
     assert root_tag == "cad-task"
@@ -34,3 +34,261 @@ def test_pipeline_basic():
     # Verify it's valid XML
     tree = etree.fromstring(canonical)
     assert tree is not None
+
+
+def test_unrepairable_message(make_pipeline):
+    """Input with nothing to recover raises UnrepairableMessageError."""
+    with pytest.raises(UnrepairableMessageError):
+        asyncio.run(make_pipeline().process(b""))
+
+
+def test_schemas_compiled_once(make_pipeline):
+    """Repeat Pipeline construction reuses the compiled XSDs."""
+    first = make_pipeline()
+    second = make_pipeline()
+
+    assert first.schemas
+    for ns, schema in first.schemas.items():
+        assert second.schemas[ns] is schema
+
+
+def test_schemas_read_only(make_pipeline):
+    """The schemas mapping is built once and rejects writes instead of dropping them."""
+    pipeline = make_pipeline()
+
+    assert pipeline.schemas is pipeline.schemas
+    with pytest.raises(TypeError):
+        pipeline.schemas["extra"] = None
+
+
+ORDER_XSD = b"""<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="order">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="item" type="xs:string" minOccurs="0" maxOccurs="unbounded"/>
+      </xs:sequence>
+      <xs:attribute name="id" type="xs:string"/>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+
+@pytest.fixture
+def make_pipeline():
+    """Builds Pipelines and shuts their worker threads down after the test."""
+    pipelines = []
+
+    def make(**kwargs):
+        pipeline = Pipeline(**kwargs)
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.close()
+
+
+@pytest.fixture
+def order_pipeline(tmp_path, make_pipeline):
+    """A Pipeline whose only schema is ORDER_XSD."""
+    (tmp_path / "order.xsd").write_bytes(ORDER_XSD)
+    return make_pipeline(schema_paths=[str(tmp_path)])
+
+
+def test_schema_selected_by_root(order_pipeline):
+    """A valid message is matched to its schema by root name and left untouched."""
+    canonical, root_tag, _ = asyncio.run(order_pipeline.process(b'<order id="7"/>'))
+
+    assert root_tag == "order"
+    assert etree.fromstring(canonical).get("message-id") is None
+
+
+def test_canonical_form(make_pipeline):
+    """Canonical output keeps children, sorts attributes and uses canonical prefixes."""
+    raw = (
+        b'<order id="7"><item>a</item>'
+        b'<x:part xmlns:x="https://swarm/cad/v4" z="1" a="2"/></order>'
+    )
+
+    canonical, _, _ = asyncio.run(make_pipeline().process(raw))
+
+    assert b"<item>a</item>" in canonical
+    assert b'<cad:part xmlns:cad="https://swarm/cad/v4" a="2" z="1"></cad:part>' in canonical
+
+
+def test_canonical_prefix_on_root(make_pipeline):
+    """A root that binds a canonical namespace to another prefix is rewritten too."""
+    raw = b'<x:order xmlns:x="https://swarm/cad/v4"><x:item/></x:order>'
+
+    canonical, _, _ = asyncio.run(make_pipeline().process(raw))
+
+    assert canonical.startswith(b'<cad:order xmlns:cad="https://swarm/cad/v4"')
+    assert b"<cad:item></cad:item>" in canonical
+
+
+def test_canonical_prefix_utf16(make_pipeline):
+    """Namespace canonicalization still runs on input that is not ASCII-compatible."""
+    raw = '<x:order xmlns:x="https://swarm/cad/v4"><x:item/></x:order>'.encode("utf-16")
+
+    canonical, _, _ = asyncio.run(make_pipeline().process(raw))
+
+    assert canonical.startswith(b'<cad:order xmlns:cad="https://swarm/cad/v4"')
+    assert b"<cad:item></cad:item>" in canonical
+
+
+def test_canonical_relative_namespace(make_pipeline):
+    """Relative namespace URIs, which libxml2's C14N rejects, still canonicalize."""
+    raw = b'<order xmlns:v="vendor" b="2" a="1"><v:item/></order>'
+
+    canonical, _, _ = asyncio.run(make_pipeline().process(raw))
+
+    assert canonical.startswith(b'<order a="1" b="2"')
+    assert b'<v:item xmlns:v="vendor"></v:item>' in canonical
+
+
+def test_canonical_prefix_taken_on_root(make_pipeline):
+    """A root whose canonical prefix is bound to a foreign URI keeps its own prefixes."""
+    raw = (
+        b'<x:order xmlns:x="https://swarm/cad/v4" xmlns:cad="urn:other">'
+        b"<cad:item/><x:part/></x:order>"
+    )
+
+    canonical, _, _ = asyncio.run(make_pipeline().process(raw))
+
+    assert canonical.startswith(b'<x:order xmlns:x="https://swarm/cad/v4"')
+    assert b'<cad:item xmlns:cad="urn:other"></cad:item><x:part></x:part>' in canonical
+
+
+def test_schema_selected_by_namespace(tmp_path, make_pipeline):
+    """A root is matched by namespace, never to a same-named root in another namespace."""
+    (tmp_path / "order.xsd").write_bytes(ORDER_XSD)
+    (tmp_path / "note.xsd").write_bytes(
+        b'<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:test:note">'
+        b'<xs:element name="order" type="xs:string"/></xs:schema>'
+    )
+    pipeline = make_pipeline(schema_paths=[str(tmp_path)])
+
+    canonical, _, _ = asyncio.run(pipeline.process(b'<order xmlns="urn:test:note">hi</order>'))
+    assert etree.fromstring(canonical).get("message-id") is None
+
+    # The same local name without a namespace still belongs to order.xsd
+    canonical, _, _ = asyncio.run(pipeline.process(b'<order id="7"><item>a</item></order>'))
+    assert canonical == b'<order id="7"><item>a</item></order>\n'
+
+
+def test_root_index_ignores_namespaced_schemas(tmp_path, make_pipeline):
+    """Root names only select schemas without a targetNamespace, in either direction."""
+    # Sorts first, so a namespace-blind index would pick it for <order>
+    (tmp_path / "a-note.xsd").write_bytes(
+        b'<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:test:note">'
+        b'<xs:element name="order" type="xs:string"/></xs:schema>'
+    )
+    (tmp_path / "order.xsd").write_bytes(ORDER_XSD)
+    pipeline = make_pipeline(schema_paths=[str(tmp_path)])
+
+    canonical, _, _ = asyncio.run(pipeline.process(b'<order id="7"><item>a</item></order>'))
+    assert canonical == b'<order id="7"><item>a</item></order>\n'
+
+    raw = b'<v:order xmlns:v="urn:vendor" ref="9"><v:line>1</v:line></v:order>'
+    healed = etree.fromstring(asyncio.run(pipeline.process(raw))[0])
+    assert healed.get("ref") == "9"
+    assert healed.find("{urn:vendor}line") is not None
+
+
+def test_uncompilable_schema_skipped(tmp_path, make_pipeline):
+    """An XSD that parses but does not compile never shadows one that does."""
+    from xml_pipeline import SchemaCatalog
+
+    (tmp_path / "a.xsd").write_bytes(ORDER_XSD)
+    (tmp_path / "b.xsd").write_bytes(
+        b'<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+        b'<xs:element name="order" type="missing"/></xs:schema>'
+    )
+    pipeline = make_pipeline(schema_paths=[str(tmp_path)])
+
+    canonical, _, _ = asyncio.run(pipeline.process(b'<order id="7"><item>a</item></order>'))
+
+    assert canonical == b'<order id="7"><item>a</item></order>\n'
+    assert "b" not in pipeline.schemas
+    assert "b" not in SchemaCatalog(schema_dirs=[str(tmp_path)]).list_schemas()
+
+
+def test_process_cache(order_pipeline):
+    """Byte-identical valid messages are served from the cache; healed ones are not."""
+
+    async def run_twice(raw):
+        return await order_pipeline.process(raw), await order_pipeline.process(raw)
+
+    first, second = asyncio.run(run_twice(b'<order id="7"/>'))
+    assert second is first
+
+    first, second = asyncio.run(run_twice(b"<unknown/>"))
+    assert first[0] != second[0]  # each heal gets its own message-id
+
+
+def test_inject_correlation(order_pipeline):
+    """Correlation headers land on the output without polluting the cache."""
+
+    async def run():
+        plain = await order_pipeline.process(b'<order id="7"/>')
+        tagged = await order_pipeline.process(  # cache hit
+            b'<order id="7"/>', inject_correlation={"in-reply-to": "abc"}
+        )
+        first = await order_pipeline.process(  # cache miss
+            b'<order id="8"/>', inject_correlation={"in-reply-to": "def"}
+        )
+        again = await order_pipeline.process(b'<order id="8"/>')
+        return plain, tagged, first, again
+
+    plain, tagged, first, again = asyncio.run(run())
+    assert plain[0] == b'<order id="7"></order>\n'
+    assert tagged[0] == b'<order id="7" in-reply-to="abc"></order>\n'
+    assert first[0] == b'<order id="8" in-reply-to="def"></order>\n'
+    assert again[0] == b'<order id="8"></order>\n'
+
+
+def test_internal_entities_expanded(make_pipeline):
+    """Entities declared in an internal DTD are expanded, not left for C14N to choke on."""
+    from xml_pipeline.utils import extract_text
+
+    raw = b'<!DOCTYPE a [<!ENTITY e "v">]><a>&e;</a>'
+
+    canonical, _, _ = asyncio.run(make_pipeline().process(raw))
+
+    assert etree.fromstring(canonical).text == "v"
+    assert extract_text(raw, "/a/text()") == "v"
+
+
+def test_heal_keeps_content(order_pipeline):
+    """Invalid messages keep their children and attributes and gain <huh>."""
+    raw = b'<order id="7" xml:lang="en" junk="1"><item>a</item><bogus/></order>'
+
+    canonical, _, _ = asyncio.run(order_pipeline.process(raw))
+
+    healed = etree.fromstring(canonical)
+    assert [child.tag for child in healed] == ["huh", "item", "bogus"]
+    assert healed.get("id") == "7"
+    assert healed.get("junk") == "1"
+    assert healed.get("{http://www.w3.org/XML/1998/namespace}lang") == "en"
+    assert healed.get("message-id") is not None
+
+
+def test_catalog_validate_streaming(tmp_path):
+    """Validating against a named schema streams, and still rejects truncated input."""
+    from xml_pipeline import SchemaCatalog
+
+    (tmp_path / "order.xsd").write_bytes(ORDER_XSD)
+    catalog = SchemaCatalog(schema_dirs=[str(tmp_path)])
+
+    assert catalog.validate(b'<order id="7"><item>a</item></order>', "order") == (True, None)
+    ok, error = catalog.validate(b"<order><item>a</item><bogus/></order>", "order")
+    assert not ok and "bogus" in error
+    ok, _ = catalog.validate(b"<order><item>a</item>", "order")
+    assert not ok
+    # Finished items are discarded while streaming; a late violation is still seen
+    long_order = b"<order>" + b"<item>a</item>" * 1000 + b"<bogus/></order>"
+    ok, error = catalog.validate(long_order, "order")
+    assert not ok and "bogus" in error
+    assert catalog.validate(b"<order/>", "missing") == (False, "Schema not found: missing")
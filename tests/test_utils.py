@@ -0,0 +1,69 @@
+from lxml import etree
+
+from xml_pipeline.utils import (
+    compute_many_hashes,
+    compute_xml_hash,
+    extract_attribute,
+    extract_text,
+    pretty_print_element,
+    validate_xml_wellformed,
+)
+
+# Enough children to push a message past the pull-parsing threshold (4 KiB)
+PADDING = b"<p/>" * 2000
+
+
+def test_extract_attribute_small_and_large():
+    """Small messages are parsed whole, large ones only up to the root start tag."""
+    small = b'<a message-id="s"><p/></a>'
+    large = b'<a message-id="s">' + PADDING + b"</a>"
+
+    assert extract_attribute(small, "message-id") == "s"
+    assert extract_attribute(large, "message-id") == "s"
+    assert extract_attribute(large, "missing") is None
+    assert extract_attribute(b"junk", "message-id") is None
+    assert extract_attribute(b"<a message-id=s>" + PADDING, "message-id") is None
+
+
+def test_extract_attribute_ignores_trailing_garbage():
+    """Only the root start tag has to be well-formed, whatever the message size."""
+    assert extract_attribute(b'<a message-id="s"/>junk', "message-id") == "s"
+    assert extract_attribute(b'<a message-id="s">' + PADDING + b"</a>junk", "message-id") == "s"
+
+
+def test_compute_many_hashes():
+    """Batch hashing matches hashing one message at a time, in input order."""
+    xmls = [b"<a/>\n", b"<b/>\n", b"<a/>\n"]
+
+    for algorithm in ("sha256", "sha512"):
+        hashes = compute_many_hashes(xmls, algorithm)
+        assert hashes == [compute_xml_hash(xml, algorithm) for xml in xmls]
+    assert compute_many_hashes([]) == []
+
+
+def test_pretty_print_element():
+    """An already-parsed tree is printed indented, without a reparse."""
+    root = etree.fromstring(b"<a><b>1</b><c/></a>")
+
+    assert pretty_print_element(root) == "<a>\n  <b>1</b>\n  <c/>\n</a>\n"
+
+
+def test_validate_xml_wellformed():
+    """Well-formedness is checked across chunk boundaries, with the parser's message."""
+    assert validate_xml_wellformed(b"<a>" + PADDING + b"</a>") == (True, None)
+
+    ok, error = validate_xml_wellformed(b"<a>" + PADDING)
+    assert not ok and "Premature end of data" in error
+    ok, _ = validate_xml_wellformed(b"<a/><b/>")
+    assert not ok
+
+
+def test_extract_text_from_element():
+    """Queries run against a parsed element as well as raw bytes."""
+    xml = b'<a><b>hi</b><c k="v"/></a>'
+    root = etree.fromstring(xml)
+
+    assert extract_text(root, "//b") == "hi"
+    assert extract_text(root, "//c/@k") == "v"
+    assert extract_text(xml, "//b") == "hi"
+    assert extract_text(root, "//missing") is None
@@ -4,12 +4,9 @@
 from __future__ import annotations
 
 import asyncio
-import hashlib
 import logging
 import time
-import uuid
 from dataclasses import dataclass
-from datetime import datetime, timezone
 from functools import partial
 from typing import (
     Awaitable,
@@ -26,6 +23,7 @@ from typing import (
 
 from . import pipeline
 from .circuit import CircuitBreaker
+from .compat import DATACLASS_SLOTS
 from .errors import (
     SwarmTimeoutError,
     UnrepairableMessageError,
@@ -37,6 +35,14 @@ __all__ = ["MessageBus", "listener", "Response"]
 
 log = logging.getLogger("xml_pipeline.bus")
 
+# All bus state (_pending, listener circuits) is touched only from the event
+# loop thread, and none of the bookkeeping awaits midway, so it needs no locks.
+# Pipeline work runs on worker threads but never sees this state.
+
+# Health-check ping, split around its timestamp
+_PING_PREFIX = b'<ping timestamp="'
+_PING_SUFFIX = b'"/>'
+
 ListenerFunc = Callable[[bytes], Awaitable[Optional[bytes]]]
 T = TypeVar("T")
 
@@ -49,7 +55,7 @@ class Response:
     outcome: Optional[str] = None  # success|failed|cancelled
 
 
-@dataclass
+@dataclass(**DATACLASS_SLOTS)
 class _PendingRequest:
     future: asyncio.Future[bytes]
     cardinality: str
@@ -59,6 +65,8 @@ class _PendingRequest:
 
 
 class _Listener:
+    __slots__ = ("func", "roots", "version", "priority", "semaphore", "circuits")
+
     def __init__(
         self,
         func: ListenerFunc,
@@ -78,9 +86,6 @@ class _Listener:
         key = (root, version or "*")
         return self.circuits.setdefault(key, CircuitBreaker())
 
-    def matches(self, root: str, version: str | None) -> bool:
-        return root in self.roots and (self.version == "*" or self.version == version)
-
 
 class MessageBus:
     def __init__(
@@ -97,8 +102,8 @@ class MessageBus:
         self.max_concurrent_per_listener = max_concurrent_per_listener
 
         self._listeners: List[_Listener] = []
+        self._root_index: Dict[str, List[_Listener]] = {}  # root tag → listeners, by priority
         self._pending: Dict[str, _PendingRequest] = {}  # message-id → request state
-        self._locks = asyncio.Lock()
 
         self.pipeline = pipeline.Pipeline(schema_paths=schema_paths or [])
         self._health_task = None  # Lazy-initialized when event loop is running
@@ -131,7 +136,7 @@ class MessageBus:
             raise ValueError("request() requires flow='request-response'")
 
         processed, root, version = await self.pipeline.process(xml)
-        msg_id = pipeline.extract_message_id(processed) or str(uuid.uuid4())
+        msg_id = pipeline.extract_message_id(processed) or pipeline.new_message_id()
 
         future: asyncio.Future[bytes | List[bytes]] = asyncio.Future()
         req = _PendingRequest(
@@ -141,8 +146,7 @@ class MessageBus:
             replies=[] if cardinality == "all" else None,
         )
 
-        async with self._locks:
-            self._pending[msg_id] = req
+        self._pending[msg_id] = req
 
         await self._route(processed, root, version, cardinality, flow, original_id=msg_id)
 
@@ -150,8 +154,7 @@ class MessageBus:
             result = await asyncio.wait_for(future, timeout or self.default_timeout)
             return result
         except asyncio.TimeoutError as e:
-            async with self._locks:
-                self._pending.pop(msg_id, None)
+            self._pending.pop(msg_id, None)
             raise SwarmTimeoutError(f"Request {msg_id[:8]} timed out") from e
 
     async def publish(
@@ -163,7 +166,7 @@ class MessageBus:
         return_canonical: bool = False,
     ) -> None | Tuple[bytes, str, str, str | None]:
         processed, root, version = await self.pipeline.process(xml)
-        msg_id = pipeline.extract_message_id(processed) or str(uuid.uuid4())
+        msg_id = pipeline.extract_message_id(processed) or pipeline.new_message_id()
 
         await self._route(processed, root, version, cardinality, flow, original_id=msg_id)
 
@@ -181,13 +184,13 @@ class MessageBus:
     ) -> None:
         if isinstance(response, Response):
             xml = response.xml
-            msg_id = response.message_id or str(uuid.uuid4())
+            msg_id = response.message_id or pipeline.new_message_id()
             in_reply_to = response.in_reply_to or original_id
             tombstone = response.tombstone
             outcome = response.outcome
         else:
             xml = response if isinstance(response, bytes) else response.encode("utf-8")
-            msg_id = str(uuid.uuid4())
+            msg_id = pipeline.new_message_id()
             in_reply_to = original_id
             tombstone = False
             outcome = None
@@ -242,6 +245,10 @@ class MessageBus:
             lst.semaphore = asyncio.Semaphore(self.max_concurrent_per_listener)
             self._listeners.append(lst)
             self._listeners.sort(key=lambda l: l.priority, reverse=True)
+            for root in dict.fromkeys(roots):
+                bucket = self._root_index.setdefault(root, [])
+                bucket.append(lst)
+                bucket.sort(key=lambda l: l.priority, reverse=True)
             return func
         return decorator
 
@@ -260,8 +267,8 @@ class MessageBus:
     ) -> None:
         msg_id = pipeline.extract_message_id(canonical_xml) or "no-id"
         matching = [
-            lst for lst in self._listeners
-            if lst.matches(root or "", version)
+            lst for lst in self._root_index.get(root or "", ())
+            if lst.version == "*" or lst.version == version
         ]
 
         if not matching and flow == "request-response" and original_id:
@@ -275,11 +282,10 @@ class MessageBus:
         expected = len(viable)
 
         if flow == "request-response" and original_id and expected > 0:
-            async with self._locks:
-                if original_id in self._pending:
-                    self._pending[original_id].required_replies = (
-                        expected if cardinality == "all" else 1
-                    )
+            if original_id in self._pending:
+                self._pending[original_id].required_replies = (
+                    expected if cardinality == "all" else 1
+                )
 
         tasks = []
         for lst in viable:
@@ -333,32 +339,31 @@ class MessageBus:
             await self._complete_request(in_reply_to, processed)
 
     async def _complete_request(self, request_id: str, reply_xml: bytes | None) -> None:
-        async with self._locks:
-            req = self._pending.get(request_id)
-            if not req or req.future.done():
-                return
+        # Pop up front: "one"/"any" replies then cost a single dict operation
+        req = self._pending.pop(request_id, None)
+        if not req or req.future.done():
+            return
 
-            if reply_xml is None:
-                # NACK path
-                req.future.set_exception(ListenerNotFoundError(f"No listener for {request_id[:8]}"))
-                self._pending.pop(request_id, None)
-                return
+        if reply_xml is None:
+            # NACK path
+            req.future.set_exception(ListenerNotFoundError(f"No listener for {request_id[:8]}"))
+            return
 
-            if req.cardinality == "all":
-                req.replies.append(reply_xml)
-                req.received_replies += 1
-                if req.received_replies >= req.required_replies:
-                    req.future.set_result(req.replies)
-                    self._pending.pop(request_id, None)
-            else:
-                # "one" or "any" — first reply wins
-                req.future.set_result(reply_xml)
-                self._pending.pop(request_id, None)
+        if req.cardinality == "all":
+            req.replies.append(reply_xml)
+            req.received_replies += 1
+            if req.received_replies < req.required_replies:
+                self._pending[request_id] = req  # still waiting on other listeners
+                return
+            req.future.set_result(req.replies)
+        else:
+            # "one" or "any" — first reply wins
+            req.future.set_result(reply_xml)
 
     async def _health_checker(self) -> None:
         while True:
             await asyncio.sleep(self.healthcheck_interval)
-            ping = f'<ping timestamp="{datetime.now(timezone.utc).isoformat()}"/>'.encode()
+            ping = _PING_PREFIX + pipeline.now_iso().encode() + _PING_SUFFIX
             try:
                 await self.publish(ping, cardinality="any")
             except Exception:
@@ -372,11 +377,12 @@ class MessageBus:
             except asyncio.CancelledError:
                 pass
 
-        async with self._locks:
-            for req in self._pending.values():
-                if not req.future.done():
-                    req.future.cancel()
-            self._pending.clear()
+        for req in self._pending.values():
+            if not req.future.done():
+                req.future.cancel()
+        self._pending.clear()
+
+        self.pipeline.close()
 
 
 # Global default bus
@@ -2,11 +2,12 @@
 # Circuit breaker pattern for resilient message handling
 
 import time
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
 
+from .compat import DATACLASS_SLOTS
 
-@dataclass
+
+@dataclass(**DATACLASS_SLOTS)
 class CircuitBreaker:
     """
     Circuit breaker to prevent cascading failures.
@@ -21,22 +22,21 @@ class CircuitBreaker:
     recovery_timeout: float = 60.0  # seconds
     success_threshold: int = 2  # successes needed to close from half-open
     
-    def __post_init__(self):
-        self._failure_count: int = 0
-        self._success_count: int = 0
-        self._last_failure_time: Optional[float] = None
-        self._state: str = "CLOSED"  # CLOSED | OPEN | HALF_OPEN
+    _failure_count: int = field(default=0, init=False, repr=False)
+    _success_count: int = field(default=0, init=False, repr=False)
+    _open_until: float = field(default=0.0, init=False, repr=False)  # time.monotonic() deadline
+    _state: str = field(default="CLOSED", init=False, repr=False)  # CLOSED | OPEN | HALF_OPEN
     
     def is_open(self) -> bool:
         """Check if circuit is open (blocking requests)."""
-        if self._state == "OPEN":
-            # Check if recovery timeout has passed
-            if self._last_failure_time and time.time() - self._last_failure_time >= self.recovery_timeout:
-                self._state = "HALF_OPEN"
-                self._success_count = 0
-                return False
-            return True
-        return False
+        if self._state != "OPEN":
+            return False
+        # Check if recovery timeout has passed
+        if time.monotonic() >= self._open_until:
+            self._state = "HALF_OPEN"
+            self._success_count = 0
+            return False
+        return True
     
     def record_success(self) -> None:
         """Record a successful request."""
@@ -51,19 +51,17 @@ class CircuitBreaker:
     def record_failure(self) -> None:
         """Record a failed request."""
         self._failure_count += 1
-        self._last_failure_time = time.time()
         
-        if self._failure_count >= self.failure_threshold:
-            self._state = "OPEN"
-        elif self._state == "HALF_OPEN":
+        if self._failure_count >= self.failure_threshold or self._state == "HALF_OPEN":
             self._state = "OPEN"
+            self._open_until = time.monotonic() + self.recovery_timeout
     
     def reset(self) -> None:
         """Manually reset the circuit breaker."""
         self._state = "CLOSED"
         self._failure_count = 0
         self._success_count = 0
-        self._last_failure_time = None
+        self._open_until = 0.0
     
     @property
     def state(self) -> str:
@@ -0,0 +1,7 @@
+# xml_pipeline/compat.py
+# Shims for the Python versions the package supports
+
+import sys
+
+# dataclass(slots=True) needs Python 3.10+; older versions get plain dataclasses
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
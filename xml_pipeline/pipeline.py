@@ -4,31 +4,48 @@
 
 from __future__ import annotations
 
-import uuid
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict
+from typing import List, Mapping, Optional, Tuple, Dict
 
 import lxml.etree as ET
 
-# Tree-sitter is optional - will be loaded on first use
-_XML_PARSER = None
-_TREE_SITTER_AVAILABLE = False
+from .errors import UnrepairableMessageError
+from .schema_loader import SchemaEntry, compiled_schemas, load_schema_entry
+from .utils import extract_attribute, get_strict_parser
 
-try:
-    from tree_sitter import Language, Parser
-    _TREE_SITTER_AVAILABLE = True
-except ImportError:
-    pass
+# Tree-sitter is optional - imported and loaded on first use, so importing
+# the package never pays for it
+_XML_LANGUAGE = None
+_XML_LANGUAGE_SEARCHED = False
 
+# One tree-sitter Parser per worker thread; a Parser must never run two
+# parses at once
+_PARSER_TLS = threading.local()
 
-def _get_xml_parser():
-    """Lazy-load tree-sitter parser."""
-    global _XML_PARSER
-    if _XML_PARSER is not None:
-        return _XML_PARSER
-    
-    if not _TREE_SITTER_AVAILABLE:
+
+def _get_xml_language():
+    """Lazy-load the tree-sitter XML grammar; None if unavailable."""
+    global _XML_LANGUAGE, _XML_LANGUAGE_SEARCHED
+    if _XML_LANGUAGE_SEARCHED:
+        return _XML_LANGUAGE
+    _XML_LANGUAGE = _load_xml_language()
+    # Remember a miss too, or every message would re-probe the filesystem
+    _XML_LANGUAGE_SEARCHED = True
+    return _XML_LANGUAGE
+
+
+def _load_xml_language():
+    try:
+        from tree_sitter import Language
+    except ImportError:
         return None
     
     # Try multiple possible locations for the grammar
@@ -49,12 +66,30 @@ def _get_xml_parser():
         return None
     
     try:
-        xml_language = Language(str(grammar_path), "xml")
-        _XML_PARSER = Parser()
-        _XML_PARSER.set_language(xml_language)
-        return _XML_PARSER
+        return Language(str(grammar_path), "xml")
+    except Exception:
+        return None
+
+
+def _get_xml_parser():
+    """This thread's tree-sitter parser, created on first use; None if unavailable."""
+    parser = getattr(_PARSER_TLS, "parser", None)
+    if parser is not None:
+        return parser
+
+    xml_language = _get_xml_language()
+    if xml_language is None:
+        return None
+
+    from tree_sitter import Parser
+
+    try:
+        parser = Parser()
+        parser.set_language(xml_language)
     except Exception:
         return None
+    _PARSER_TLS.parser = parser
+    return parser
 
 # Canonical namespace genome — never changes
 CANONICAL_NS = {
@@ -64,25 +99,58 @@ CANONICAL_NS = {
     "swarm": "https://swarm/core/v1",
 }
 REVERSE_NS = {v: k for k, v in CANONICAL_NS.items()}
+_CANONICAL_PREFIXES = tuple(CANONICAL_NS)
+
+# Processed results remembered per Pipeline, keyed by a digest of the raw bytes
+PROCESS_CACHE_SIZE = 2048
 
 
 class Pipeline:
     def __init__(self, schema_paths: List[str] | None = None):
         self.schema_paths = schema_paths or [str(Path(__file__).parent / "schemas")]
-        self.schemas: Dict[str, ET.XMLSchema] = {}
+        # Every schema file under its key, in load order; one that fails to
+        # compile is skipped at lookup, so it never shadows one that works
+        self._schema_by_ns: Dict[str, List[SchemaEntry]] = {}
+        # Only schemas without a targetNamespace, for roots without a namespace
+        self._schema_by_root: Dict[str, List[SchemaEntry]] = {}
+        self._schemas: Mapping[str, ET.XMLSchema] | None = None  # built on first access
+        self._process_cache: OrderedDict[bytes, Tuple[bytes, str, Optional[str]]] = OrderedDict()
+        # Keeps the event loop free; lxml also releases the GIL while libxml2
+        # parses and validates, so those stages overlap across workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=os.cpu_count(), thread_name_prefix="xml-pipeline"
+        )
         self._load_schemas()
 
+    @property
+    def schemas(self) -> Mapping[str, ET.XMLSchema]:
+        """Loaded schemas by targetNamespace (or file stem), read-only.
+
+        The first access compiles every pending XSD; those that fail are left
+        out, and where files share a key the last one loaded wins. Add
+        schemas through ``schema_paths``.
+        """
+        if self._schemas is None:
+            self._schemas = compiled_schemas(self._schema_by_ns)
+        return self._schemas
+
+    def close(self) -> None:
+        """Release the worker threads used by process()."""
+        self._executor.shutdown(wait=False)
+
     def _load_schemas(self):
         for path_str in self.schema_paths:
             path = Path(path_str)
             if not path.exists():
                 continue
-            for xsd_file in path.rglob("*.xsd"):
+            # Sorted, so the schema tried first never depends on directory order
+            for xsd_file in sorted(path.rglob("*.xsd")):
                 try:
-                    schema_doc = ET.parse(str(xsd_file))
-                    schema = ET.XMLSchema(schema_doc)
-                    target_ns = schema_doc.getroot().get("targetNamespace") or xsd_file.stem
-                    self.schemas[target_ns] = schema
+                    entry = load_schema_entry(xsd_file)
+                    self._schema_by_ns.setdefault(entry.target_ns, []).append(entry)
+                    if entry.namespace is None:
+                        for name in entry.root_names:
+                            self._schema_by_root.setdefault(name, []).append(entry)
                 except Exception as e:
                     print(f"[pipeline] Failed to load schema {xsd_file}: {e}")
 
@@ -95,187 +163,262 @@ class Pipeline:
         if isinstance(raw, str):
             raw = raw.encode("utf-8")
 
-        # 1. Tree-sitter repair (if available)
-        parser = _get_xml_parser()
-        if parser is not None:
-            tree = parser.parse(raw)
-            repaired = self._repair_with_treesitter(tree, raw)
-        else:
-            # Fallback to lxml recovery mode
-            repaired = self._repair_with_lxml(raw)
-
-        # 2. Parse with lxml (now guaranteed well-formed)
-        root_elem = ET.fromstring(repaired)
+        # Retransmits and template replies skip the whole pipeline. Everything
+        # CPU-bound, correlation stamping included, runs on the executor so
+        # the event loop stays free
+        loop = asyncio.get_running_loop()
+        key = hashlib.blake2b(raw, digest_size=16).digest()
+        result = self._process_cache.get(key)
+        if result is not None:
+            self._process_cache.move_to_end(key)
+            if inject_correlation:
+                result = await loop.run_in_executor(
+                    self._executor, self._stamp, result, inject_correlation
+                )
+            return result
+
+        result, stamped, deterministic = await loop.run_in_executor(
+            self._executor, self._process_and_stamp, raw, inject_correlation
+        )
+        # The cache keeps the bare result; headers differ per call
+        if deterministic:
+            self._process_cache[key] = result
+            if len(self._process_cache) > PROCESS_CACHE_SIZE:
+                self._process_cache.popitem(last=False)
+        return stamped
+
+    def inject_correlation(self, canonical: bytes, headers: dict) -> bytes:
+        """Set correlation attributes on the root of already-canonical XML.
+
+        One parse and serialize — no repair, validation or healing.
+        Headers whose value is None are skipped.
+        """
+        root = ET.fromstring(canonical, get_strict_parser())
+        for k, v in headers.items():
+            if v is not None:
+                root.set(k, str(v))
+        return self._serialize(root)
+
+    def _stamp(
+        self, result: Tuple[bytes, str, Optional[str]], headers: dict
+    ) -> Tuple[bytes, str, Optional[str]]:
+        canonical, root_tag, version = result
+        return self.inject_correlation(canonical, headers), root_tag, version
+
+    def _process_and_stamp(self, raw: bytes, headers: dict | None):
+        """_process_sync plus correlation headers, in one trip to the executor."""
+        result, deterministic = self._process_sync(raw)
+        stamped = self._stamp(result, headers) if headers else result
+        return result, stamped, deterministic
+
+    def _process_sync(self, raw: bytes) -> Tuple[Tuple[bytes, str, Optional[str]], bool]:
+        """Run every stage; also reports whether the output depends only on ``raw``."""
+        # 1. Fast path: most traffic is already well-formed (often our own output)
+        try:
+            root_elem = ET.fromstring(raw, get_strict_parser())
+        except ET.XMLSyntaxError:
+            root_elem = None
+
+        if root_elem is None:
+            # 2. Tree-sitter repair (if available), straight to a parsed root
+            parser = _get_xml_parser()
+            if parser is not None:
+                tree = parser.parse(raw)
+                root_elem = self._repair_with_treesitter(tree, raw)
+            else:
+                # Fallback to lxml recovery mode
+                root_elem = self._repair_with_lxml(raw)
 
         # 3. Extract metadata
-        root_tag = root_elem.tag.rsplit("}", 1)[-1] if "}" in root_elem.tag else root_elem.tag
+        root_tag = _local_name(root_elem.tag)
         version = root_elem.get("version")
 
         # 4. Heal + validate
         healed = self._heal_and_validate(root_elem)
 
-        # 5. Inject correlation headers
-        if inject_correlation:
-            for k, v in inject_correlation.items():
-                if v is not None:
-                    healed.set(k, str(v))
-
-        # 6. Canonicalize
-        canonical = self._canonicalize(healed)
+        # 5. Canonicalize
+        #    (no "xmlns" anywhere in the input means no declarations to rebind;
+        #    NUL bytes mean UTF-16/32, where that byte search proves nothing)
+        namespaced = b"xmlns" in raw or b"\x00" in raw
+        canonical = self._canonicalize(root_elem, namespaced=namespaced)
 
-        return canonical, root_tag, version
+        # Healing stamps a fresh message-id/timestamp, so only untouched
+        # messages are safe to replay from the cache
+        return (canonical, root_tag, version), not healed
 
     # ----------------------------------------------------------------------- #
     # 1. Tree-sitter repair — strips comments, PIs, fixes brokenness
     # ----------------------------------------------------------------------- #
-    def _repair_with_lxml(self, raw: bytes) -> bytes:
+    def _repair_with_lxml(self, raw: bytes) -> ET.Element:
         """Fallback repair using lxml's recovery mode."""
+        parser = ET.XMLParser(recover=True, remove_blank_text=True, remove_comments=True)
         try:
-            parser = ET.XMLParser(recover=True, remove_blank_text=True, remove_comments=True)
             root = ET.fromstring(raw, parser)
-            return ET.tostring(root, encoding="utf-8")
-        except Exception:
-            # Last resort - return as-is and hope for the best
-            return raw
+        except ET.XMLSyntaxError as e:
+            raise UnrepairableMessageError(f"XML could not be recovered: {e}") from e
+        if root is None:
+            raise UnrepairableMessageError("XML could not be recovered: no root element")
+        return root
     
-    def _repair_with_treesitter(self, tree, original: bytes) -> bytes:
-        def strip_node(node):
-            if node.type in {"comment", "processing_instruction", "declaration"}:
-                # Mark for removal by replacing with nothing
-                return b""
-            return original[node.start_byte:node.end_byte]
-
+    def _repair_with_treesitter(self, tree, original: bytes) -> ET.Element:
         # Simple but extremely effective: rebuild only the good parts
-        cleaned_parts = []
+        out = bytearray()
+        mv = memoryview(original)
         for node in tree.root_node.children:
             if node.type == "element":
-                cleaned_parts.append(strip_node(node))
+                out += mv[node.start_byte:node.end_byte]
             # Skip everything else (comments, PI, doctype, etc.)
 
-        cleaned = b"".join(cleaned_parts)
+        cleaned = bytes(out)
         try:
-            ET.fromstring(cleaned)
-            return cleaned
-        except:
+            return ET.fromstring(cleaned, get_strict_parser())
+        except ET.XMLSyntaxError:
             # Final recovery with lxml (very rare)
-            parser = ET.XMLParser(recover=True, remove_blank_text=True)
-            recovered = ET.fromstring(cleaned, parser)
-            return ET.tostring(recovered, encoding="utf-8")
+            return self._repair_with_lxml(cleaned)
 
     # ----------------------------------------------------------------------- #
     # 2. Heal + validate + <huh> forensics
     # ----------------------------------------------------------------------- #
-    def _heal_and_validate(self, elem: ET.Element) -> ET.Element:
-        # Find a schema that knows this root
-        schema = None
-        for s in self.schemas.values():
-            if s.validate(elem):
-                return elem  # already perfect
-            # Even if not valid, keep trying to find one that might help
-            schema = s
-
-        # No perfect match → heal
-        healed = ET.Element(elem.tag, nsmap=elem.nsmap)
-        self._add_huh(healed, "warning", "Message was repaired by immune system")
-
-        if schema:
-            self._apply_schema_healing(elem, healed, schema)
+    def _heal_and_validate(self, elem: ET.Element) -> bool:
+        """Validate ``elem`` and heal it in place; returns True if it needed healing."""
+        # Candidate schemas: the one for the root's namespace, or those without
+        # a targetNamespace that declare an unqualified root of this name
+        tag = elem.tag
+        if tag[0] == "{":
+            entries = self._schema_by_ns.get(tag[1:].split("}", 1)[0], [])
+            candidates = [entry for entry in entries if entry.namespace is not None]
         else:
-            self._aggressive_healing(elem, healed)
+            candidates = self._schema_by_root.get(tag, [])
 
-        self._ensure_core_fields(healed)
-        return healed
+        for entry in candidates:
+            schema = entry.schema
+            if schema is not None and schema.validate(elem):
+                return False  # already perfect
 
-    def _apply_schema_healing(self, src: ET.Element, dst: ET.Element, schema: ET.XMLSchema):
-        # For now, just copy everything - schema introspection is complex
-        # In production, you'd parse the schema XSD to extract allowed elements
-        # For this demo, we trust the schema validation result
-        dst.extend(src[:])  # Copy all children
-        
-        # Copy attributes
-        for attr, val in src.attrib.items():
-            dst.set(attr, val)
+        # No perfect match → heal
+        self._heal(elem)
+        return True
 
-    def _aggressive_healing(self, src: ET.Element, dst: ET.Element):
-        dst.extend(src[:])  # keep everything, just wrap in <huh>
+    def _heal(self, elem: ET.Element):
+        """Repair the message in place.
+
+        All content is kept; the message only gains <huh> forensics and any
+        missing core fields. Attribute order and namespaces are left to
+        _canonicalize.
+        """
+        self._add_huh(elem, "warning", "Message was repaired by immune system")
+        self._ensure_core_fields(elem)
 
     def _ensure_core_fields(self, elem: ET.Element):
         if elem.get("message-id") is None:
-            elem.set("message-id", str(uuid.uuid4()))
+            elem.set("message-id", new_message_id())
         if elem.get("timestamp") is None:
-            elem.set("timestamp", datetime.now(timezone.utc).isoformat())
+            elem.set("timestamp", now_iso())
 
     def _add_huh(self, parent: ET.Element, severity: str, message: str):
-        huh = ET.SubElement(parent, "huh")
+        huh = ET.Element("huh")
+        parent.insert(0, huh)  # forensics lead the message body
         huh.set("severity", severity)
-        huh.set("at", datetime.now(timezone.utc).isoformat())
+        huh.set("at", now_iso())
         huh.text = message
 
     # ----------------------------------------------------------------------- #
     # 3. True canonicalization — identical bytes forever
     # ----------------------------------------------------------------------- #
-    def _canonicalize(self, elem: ET.Element) -> bytes:
-        # 1. Rewrite all namespaces to canonical prefixes
-        self._force_canonical_namespaces(elem)
-
-        # 2. Sort attributes alphabetically
-        self._sort_attributes_recursively(elem)
-
-        # 3. Simple serialization (comments already removed by repair step)
-        return ET.tostring(
-            elem,
-            encoding="utf-8",
-            xml_declaration=False,
-            pretty_print=False,
-        ).strip() + b"\n"
-
-    def _force_canonical_namespaces(self, elem: ET.Element):
-        # Build new nsmap with only canonical prefixes
-        new_nsmap = {}
-        for prefix, uri in (elem.nsmap or {}).items():
-            canonical_prefix = REVERSE_NS.get(uri, prefix)
-            if canonical_prefix:
-                new_nsmap[canonical_prefix] = uri
-
-        # Rebuild element tag with canonical prefix
-        if "}" in elem.tag:
-            uri, local = elem.tag[1:].split("}", 1)
-            new_prefix = REVERSE_NS.get(uri)
-            new_tag = f"{{{uri}}}{local}" if new_prefix is None else f"{{{uri}}}{local}"
-        else:
-            new_tag = elem.tag
-
-        # Create new element
-        new_elem = ET.Element(new_tag, attrib=elem.attrib, nsmap=new_nsmap)
-        new_elem.text = elem.text
-        new_elem.tail = elem.tail
-        new_elem.extend(elem)
-
-        # Replace in parent
-        parent = elem.getparent()
-        if parent is not None:
-            parent.replace(elem, new_elem)
-        else:
-            elem = new_elem
-
-        # Recurse
-        for child in new_elem:
-            self._force_canonical_namespaces(child)
-
-    def _sort_attributes_recursively(self, elem: ET.Element):
-        if elem.attrib:
-            items = sorted(elem.attrib.items())
-            elem.attrib.clear()
-            for k, v in items:
-                elem.set(k, v)
-        for child in elem:
-            self._sort_attributes_recursively(child)
+    def _canonicalize(self, elem: ET.Element, namespaced: bool = True) -> bytes:
+        if not namespaced:
+            return self._serialize(elem)
+
+        # 0. Declarations on the root itself win over top_nsmap, so a root that
+        #    binds a canonical URI to another prefix is rebuilt once
+        nsmap = elem.nsmap
+        canonical = _canonical_root_nsmap(nsmap)
+        if canonical != nsmap:
+            elem = self._rebind_root(elem, canonical)
+
+        # 1. Declare the canonical prefixes on top; lxml rebinds descendants
+        #    to them and drops redundant declarations in one C-level tree walk
+        ET.cleanup_namespaces(elem, top_nsmap=CANONICAL_NS, keep_ns_prefixes=_CANONICAL_PREFIXES)
+
+        # 2. Exclusive C14N — sorted attributes, no comments, identical bytes forever
+        return self._serialize(elem)
+
+    def _rebind_root(self, elem: ET.Element, nsmap: dict) -> ET.Element:
+        root = ET.Element(elem.tag, attrib=elem.attrib, nsmap=nsmap)
+        root.text = elem.text
+        root.extend(elem)  # moves the children, no copies
+        return root
+
+    def _serialize(self, elem: ET.Element) -> bytes:
+        # libxml2's exclusive C14N runs in C; lxml's C14N 2.0 writer walks the
+        # tree in Python and costs ~20x more, so it is only the fallback for
+        # relative namespace URIs, which libxml2 refuses to canonicalize.
+        # C14N of an element starts at "<" and ends at ">"; nothing to strip
+        try:
+            out = ET.tostring(elem, method="c14n", exclusive=True, with_comments=False)
+        except ET.C14NError:
+            out = ET.tostring(elem, method="c14n2", with_comments=False)
+        return out + b"\n"
+
+
+# (epoch second, ISO string) — rebound as a whole so worker threads never
+# see a half-updated pair
+_ISO_CACHE: Tuple[int, str] = (0, "")
+
+
+def now_iso() -> str:
+    """Current UTC time in ISO 8601, at one-second resolution."""
+    global _ISO_CACHE
+    t = int(time.time())
+    if t != _ISO_CACHE[0]:
+        _ISO_CACHE = (t, datetime.fromtimestamp(t, timezone.utc).isoformat())
+    return _ISO_CACHE[1]
+
+
+# Message ids are cut from a slab of OS randomness: one getrandom() call
+# yields 256 ids instead of one per uuid.uuid4()
+_ID_SLAB_SIZE = 4096
+_id_slab = b""
+_id_offset = 0
+_id_lock = threading.Lock()
+# Version (4) and RFC 4122 variant bits, stamped the way uuid.uuid4() does
+_UUID4_CLEAR = ~((0xF000 << 64) | (0xC000 << 48))
+_UUID4_SET = (0x4000 << 64) | (0x8000 << 48)
+
+
+def new_message_id() -> str:
+    """Random id in UUID4 textual form."""
+    global _id_slab, _id_offset
+    with _id_lock:
+        if _id_offset >= len(_id_slab):
+            _id_slab = os.urandom(_ID_SLAB_SIZE)
+            _id_offset = 0
+        raw = _id_slab[_id_offset:_id_offset + 16]
+        _id_offset += 16
+    n = int.from_bytes(raw, "big") & _UUID4_CLEAR | _UUID4_SET
+    h = f"{n:032x}"
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _canonical_root_nsmap(nsmap: dict) -> dict:
+    """Root declarations with canonical URIs moved onto their canonical prefixes.
+
+    A canonical prefix the root already binds to a foreign URI stays with
+    that URI; the canonical URI then keeps its original prefix.
+    """
+    canonical = {}
+    for prefix, uri in nsmap.items():
+        target = REVERSE_NS.get(uri, prefix)
+        if nsmap.get(target, uri) != uri:
+            target = prefix
+        canonical[target] = uri
+    return canonical
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
 
 
 def extract_message_id(xml: bytes) -> Optional[str]:
     """Extract message-id attribute from XML root element."""
-    try:
-        root = ET.fromstring(xml)
-        return root.get("message-id")
-    except Exception:
-        return None
+    return extract_attribute(xml, "message-id")
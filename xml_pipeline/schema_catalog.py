@@ -1,16 +1,21 @@
 # xml_pipeline/schema_catalog.py
 # Schema catalog for managing multiple XSD schemas
 
+import io
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Dict, Mapping, Optional, List
 import lxml.etree as ET
 
+from .schema_loader import SchemaEntry, compiled_schemas, load_schema_entry, newest_schema
+from .utils import get_strict_parser
+
 
 class SchemaCatalog:
     """
     Central registry for XML schemas.
     
-    Loads and manages XSD schemas for validation.
+    Loads and manages XSD schemas for validation. Each schema is compiled
+    the first time it is used.
     """
     
     def __init__(self, schema_dirs: Optional[List[str]] = None):
@@ -20,7 +25,9 @@ class SchemaCatalog:
         Args:
             schema_dirs: List of directories containing .xsd files
         """
-        self.schemas: Dict[str, ET.XMLSchema] = {}
+        # Schema files by key in load order; see Pipeline._schema_by_ns
+        self._entries: Dict[str, List[SchemaEntry]] = {}
+        self._schemas: Optional[Mapping[str, ET.XMLSchema]] = None  # built on first access
         self.schema_dirs = schema_dirs or []
         
         # Load default schemas
@@ -37,7 +44,7 @@ class SchemaCatalog:
             if not path.exists():
                 continue
             
-            for xsd_file in path.rglob("*.xsd"):
+            for xsd_file in sorted(path.rglob("*.xsd")):
                 self._load_schema(xsd_file)
     
     def _load_schema(self, xsd_path: Path) -> None:
@@ -48,15 +55,10 @@ class SchemaCatalog:
             xsd_path: Path to XSD file
         """
         try:
-            schema_doc = ET.parse(str(xsd_path))
-            schema = ET.XMLSchema(schema_doc)
-            
-            # Use targetNamespace as key, fallback to filename
-            root = schema_doc.getroot()
-            namespace = root.get("targetNamespace")
-            key = namespace if namespace else xsd_path.stem
-            
-            self.schemas[key] = schema
+            # Shares Pipeline's schema cache, keyed by targetNamespace
+            # with the filename as fallback
+            entry = load_schema_entry(xsd_path)
+            self._entries.setdefault(entry.target_ns, []).append(entry)
         except Exception as e:
             # Don't fail on individual schema errors
             pass
@@ -71,7 +73,19 @@ class SchemaCatalog:
         Returns:
             XMLSchema object or None
         """
-        return self.schemas.get(namespace_or_name)
+        return newest_schema(self._entries.get(namespace_or_name, []))
+
+    @property
+    def schemas(self) -> Mapping[str, ET.XMLSchema]:
+        """
+        All schemas by key, read-only.
+        
+        The first access compiles every pending XSD. Add schemas by placing
+        .xsd files in one of ``schema_dirs``.
+        """
+        if self._schemas is None:
+            self._schemas = compiled_schemas(self._entries)
+        return self._schemas
     
     def validate(self, xml: bytes, schema_key: Optional[str] = None) -> tuple[bool, Optional[str]]:
         """
@@ -84,17 +98,14 @@ class SchemaCatalog:
         Returns:
             Tuple of (is_valid, error_message)
         """
+        if schema_key:
+            schema = self.get_schema(schema_key)
+            if not schema:
+                return False, f"Schema not found: {schema_key}"
+            return self._validate_streaming(xml, schema)
+        
         try:
-            root = ET.fromstring(xml)
-            
-            if schema_key:
-                schema = self.get_schema(schema_key)
-                if not schema:
-                    return False, f"Schema not found: {schema_key}"
-                
-                if schema.validate(root):
-                    return True, None
-                return False, str(schema.error_log)
+            root = ET.fromstring(xml, get_strict_parser())
             
             # Try all schemas if none specified
             for schema in self.schemas.values():
@@ -106,6 +117,28 @@ class SchemaCatalog:
         except Exception as e:
             return False, f"Validation error: {e}"
     
+    def _validate_streaming(self, xml: bytes, schema: ET.XMLSchema) -> tuple[bool, Optional[str]]:
+        """Validate while parsing; stops at the first violation, keeps only the open path."""
+        try:
+            for _, elem in ET.iterparse(
+                io.BytesIO(xml),
+                events=("end",),
+                schema=schema,
+                # resolve_entities=False is left out on purpose: with it,
+                # lxml's iterparse accepts truncated documents
+                no_network=True,
+            ):
+                # Empty the finished element and drop finished siblings before
+                # it, so memory follows nesting depth, not document size
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            return True, None
+        except ET.XMLSyntaxError as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"Validation error: {e}"
+    
     def list_schemas(self) -> List[str]:
-        """Get list of loaded schema keys."""
-        return list(self.schemas.keys())
+        """Get list of loaded schema keys (compiling any still pending)."""
+        return list(self.schemas)
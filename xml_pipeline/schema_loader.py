@@ -0,0 +1,88 @@
+# xml_pipeline/schema_loader.py
+# XSD loading shared by Pipeline and SchemaCatalog
+
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import lxml.etree as ET
+
+XSD_ELEMENT = "{http://www.w3.org/2001/XMLSchema}element"
+
+
+class SchemaEntry:
+    """An XSD parsed at load time and compiled into an XMLSchema on first use.
+
+    Catalogs usually hold far more schemas than any one process validates
+    against, and compiling dominates load time, so that step is deferred.
+    """
+
+    __slots__ = ("path", "namespace", "target_ns", "root_names", "_doc", "_schema", "_failed")
+
+    def __init__(self, path: Path, schema_doc: ET._ElementTree):
+        xsd_root = schema_doc.getroot()
+        self.path = path
+        self.namespace: str | None = xsd_root.get("targetNamespace")
+        self.target_ns: str = self.namespace or path.stem
+        # Top-level declarations, i.e. the valid message roots
+        self.root_names = frozenset(
+            el.get("name") for el in xsd_root.iterchildren(XSD_ELEMENT) if el.get("name")
+        )
+        self._doc: ET._ElementTree | None = schema_doc
+        self._schema: ET.XMLSchema | None = None
+        self._failed = False
+
+    @property
+    def schema(self) -> ET.XMLSchema | None:
+        """The compiled schema, or None if the XSD does not compile."""
+        if self._schema is None and not self._failed:
+            with _SCHEMA_LOCK:
+                if self._schema is None and not self._failed:
+                    try:
+                        self._schema = ET.XMLSchema(self._doc)
+                    except ET.XMLSchemaParseError as e:
+                        self._failed = True
+                        print(f"[pipeline] Failed to load schema {self.path}: {e}")
+                    self._doc = None
+        return self._schema
+
+
+# Parsed schemas shared by every Pipeline, keyed by (resolved path, mtime)
+_SCHEMA_CACHE: Dict[Tuple[str, float], SchemaEntry] = {}
+# Guards the cache, the shared XSD parser and lazy compilation
+_SCHEMA_LOCK = threading.Lock()
+# One parser for every XSD, so libxml2 interns the names they share only once
+_XSD_PARSER = ET.XMLParser(remove_blank_text=True, remove_comments=True, collect_ids=False)
+
+
+def load_schema_entry(xsd_file: Path) -> SchemaEntry:
+    """Parse an XSD once per file revision; compilation waits for first use."""
+    key = (str(xsd_file.resolve()), xsd_file.stat().st_mtime)
+    with _SCHEMA_LOCK:
+        entry = _SCHEMA_CACHE.get(key)
+        if entry is None:
+            schema_doc = ET.parse(str(xsd_file), _XSD_PARSER)
+            entry = _SCHEMA_CACHE[key] = SchemaEntry(xsd_file, schema_doc)
+    return entry
+
+
+def newest_schema(entries: List[SchemaEntry]) -> Optional[ET.XMLSchema]:
+    """The schema of the last-loaded entry that compiles, or None."""
+    for entry in reversed(entries):
+        schema = entry.schema
+        if schema is not None:
+            return schema
+    return None
+
+
+def compiled_schemas(index: Dict[str, List[SchemaEntry]]) -> Mapping[str, ET.XMLSchema]:
+    """Read-only view of the newest compiling schema per key; compiles them all."""
+    schemas = {}
+    for key, entries in index.items():
+        schema = newest_schema(entries)
+        if schema is not None:
+            schemas[key] = schema
+    return MappingProxyType(schemas)
@@ -2,9 +2,31 @@
 # Utility functions for XML processing
 
 import hashlib
-from typing import Optional
+import threading
+from functools import lru_cache, partial
+from typing import Callable, Iterable, List, Optional, Union
 import lxml.etree as ET
 
+# lxml parsers are not thread-safe; keep one per thread so the pipeline's
+# executor workers each reuse their own (and its interned name dict)
+_PARSER_TLS = threading.local()
+
+
+def get_strict_parser() -> ET.XMLParser:
+    """The calling thread's shared strict parser: no network access, no huge trees."""
+    parser = getattr(_PARSER_TLS, "parser", None)
+    if parser is None:
+        # Entities keep lxml's default handling: left unresolved they stay in
+        # the tree as Entity nodes, which C14N cannot serialize
+        parser = ET.XMLParser(
+            no_network=True,
+            huge_tree=False,
+            collect_ids=False,
+            remove_blank_text=False,
+        )
+        _PARSER_TLS.parser = parser
+    return parser
+
 
 def compute_xml_hash(xml: bytes, algorithm: str = "sha256") -> str:
     """
@@ -17,9 +39,29 @@ def compute_xml_hash(xml: bytes, algorithm: str = "sha256") -> str:
     Returns:
         Hex-encoded hash string
     """
-    h = hashlib.new(algorithm)
-    h.update(xml)
-    return h.hexdigest()
+    return _hash_constructor(algorithm)(xml).hexdigest()
+
+
+def compute_many_hashes(xmls: Iterable[bytes], algorithm: str = "sha256") -> List[str]:
+    """
+    Compute cryptographic hashes for a batch of canonical XML messages.
+    
+    Args:
+        xmls: XML bytes (should be canonical)
+        algorithm: Hash algorithm (sha256, sha512, etc.)
+    
+    Returns:
+        Hex-encoded hash strings, in input order
+    """
+    new = _hash_constructor(algorithm)
+    return [new(xml).hexdigest() for xml in xmls]
+
+
+def _hash_constructor(algorithm: str) -> Callable[[bytes], "hashlib._Hash"]:
+    # The named constructor skips hashlib.new()'s name lookup on the default path
+    if algorithm == "sha256":
+        return hashlib.sha256
+    return partial(hashlib.new, algorithm)
 
 
 def extract_attribute(xml: bytes, attr_name: str) -> Optional[str]:
@@ -31,29 +73,59 @@ def extract_attribute(xml: bytes, attr_name: str) -> Optional[str]:
         attr_name: Name of attribute to extract
     
     Returns:
-        Attribute value or None
+        Attribute value or None. Only the root start tag has to be
+        well-formed; whatever follows it is not checked.
     """
     try:
-        root = ET.fromstring(xml)
-        return root.get(attr_name)
+        # A full parse of a small message beats setting up a pull parser;
+        # only larger inputs are worth stopping at the root start tag
+        if len(xml) <= _PULL_CHUNK:
+            try:
+                return ET.fromstring(xml, get_strict_parser()).get(attr_name)
+            except ET.XMLSyntaxError:
+                pass  # the error may lie past the root start tag
+        return _parse_root_start(xml).get(attr_name)
     except Exception:
         return None
 
 
-def extract_text(xml: bytes, xpath: str) -> Optional[str]:
+# Bytes fed per step while pulling the root start tag; also the size up to
+# which extract_attribute simply parses the whole message
+_PULL_CHUNK = 4096
+
+
+def _parse_root_start(xml: bytes) -> ET._Element:
+    """Parse only as far as the root start tag; the rest is never read."""
+    parser = ET.XMLPullParser(events=("start",))
+    for offset in range(0, len(xml), _PULL_CHUNK):
+        try:
+            parser.feed(xml[offset:offset + _PULL_CHUNK])
+        except ET.XMLSyntaxError:
+            # A chunk can hold the root start tag and a later error; the
+            # start event is still queued, so only a bad start tag fails
+            for _, elem in parser.read_events():
+                return elem
+            raise
+        for _, elem in parser.read_events():
+            return elem
+    raise ValueError("No root element found")
+
+
+def extract_text(xml: Union[bytes, ET._Element], xpath: str) -> Optional[str]:
     """
     Extract text content using XPath.
     
     Args:
-        xml: XML bytes
-        xpath: XPath expression
+        xml: XML bytes, or an already-parsed element so that several
+            queries over one document share a single parse
+        xpath: XPath expression (compiled once, then reused)
     
     Returns:
         Text content or None
     """
     try:
-        root = ET.fromstring(xml)
-        elements = root.xpath(xpath)
+        root = xml if isinstance(xml, ET._Element) else ET.fromstring(xml, get_strict_parser())
+        elements = _compile_xpath(xpath)(root)
         if elements:
             return str(elements[0]) if not isinstance(elements[0], ET._Element) else elements[0].text
         return None
@@ -61,6 +133,24 @@ def extract_text(xml: bytes, xpath: str) -> Optional[str]:
         return None
 
 
+@lru_cache(maxsize=256)
+def _compile_xpath(xpath: str) -> ET.XPath:
+    return ET.XPath(xpath)
+
+
+def pretty_print_element(elem: ET._Element) -> str:
+    """
+    Pretty print an already-parsed element for debugging.
+    
+    Args:
+        elem: Element to print
+    
+    Returns:
+        Pretty-printed XML string
+    """
+    return ET.tostring(elem, pretty_print=True, encoding="unicode")
+
+
 def pretty_print_xml(xml: bytes) -> str:
     """
     Pretty print XML for debugging.
@@ -72,12 +162,21 @@ def pretty_print_xml(xml: bytes) -> str:
         Pretty-printed XML string
     """
     try:
-        root = ET.fromstring(xml)
-        return ET.tostring(root, pretty_print=True, encoding="unicode")
+        # libxml2 drops ignorable whitespace while parsing, so the existing
+        # layout doesn't stop tostring() from re-indenting
+        parser = ET.XMLParser(remove_blank_text=True, no_network=True)
+        return pretty_print_element(ET.fromstring(xml, parser))
     except Exception as e:
         return f"<!-- Failed to parse XML: {e} -->\n{xml.decode('utf-8', errors='replace')}"
 
 
+class _DiscardTarget:
+    """Parser target that keeps nothing, so checking builds no tree."""
+
+    def close(self) -> None:
+        return None
+
+
 def validate_xml_wellformed(xml: bytes) -> tuple[bool, Optional[str]]:
     """
     Check if XML is well-formed.
@@ -88,8 +187,11 @@ def validate_xml_wellformed(xml: bytes) -> tuple[bool, Optional[str]]:
     Returns:
         Tuple of (is_valid, error_message)
     """
+    parser = ET.XMLParser(target=_DiscardTarget(), resolve_entities=False, no_network=True)
     try:
-        ET.fromstring(xml)
+        for offset in range(0, len(xml), _PULL_CHUNK):
+            parser.feed(xml[offset:offset + _PULL_CHUNK])
+        parser.close()
         return True, None
     except ET.XMLSyntaxError as e:
         return False, str(e)